@@ -1,5 +1,7 @@
 import duckdb
+import numpy as np
 import os
+from concurrent.futures import ThreadPoolExecutor
 import pandas as pd
 import streamlit as st
 import polars as pl
@@ -14,8 +16,183 @@ st.set_page_config(
 
 st.title("MLR Analysis Dashboard")
 
-@st.cache_data(ttl=3600)
-def load_data_from_motherduck():
+# Row style for companies whose MLR is above 75%
+HIGH_MLR_STYLE = 'background-color: #ffcccc; color: red; font-weight: bold'
+
+# Only the columns used by calculate_mlr / calculate_retail_mlr are pulled from MotherDuck,
+# already cast to the dtypes the calculations expect so the cached frames need no recasting.
+# PA and CLAIMS are pre-filtered to rows inside a contract window and DEBIT drops TPA lines,
+# so those rows never cross the network. The retail joins and aggregations run entirely in
+# DuckDB; only their per-member and per-plan results are returned.
+TABLE_QUERIES = {
+    "PA": """
+        SELECT pa.groupname,
+               CAST(pa.requestdate AS TIMESTAMP) AS requestdate,
+               TRY_CAST(pa.granted AS DOUBLE) AS granted
+        FROM clearline_db.total_pa_procedures pa
+        WHERE EXISTS (
+            SELECT 1
+            FROM clearline_db.group_contract gc
+            WHERE gc.groupname = pa.groupname
+              AND CAST(pa.requestdate AS TIMESTAMP)
+                  BETWEEN CAST(gc.startdate AS TIMESTAMP) AND CAST(gc.enddate AS TIMESTAMP)
+        )
+    """,
+    "GROUP_CONTRACT": """
+        SELECT groupname,
+               CAST(startdate AS TIMESTAMP) AS startdate,
+               CAST(enddate AS TIMESTAMP) AS enddate
+        FROM clearline_db.group_contract
+    """,
+    "CLAIMS": """
+        SELECT CAST(c.approvedamount AS DOUBLE) AS approvedamount,
+               CAST(c.encounterdatefrom AS TIMESTAMP) AS encounterdatefrom,
+               CAST(c.nhisgroupid AS VARCHAR) AS nhisgroupid
+        FROM clearline_db.claims c
+        WHERE EXISTS (
+            SELECT 1
+            FROM clearline_db.all_group g
+            JOIN clearline_db.group_contract gc ON gc.groupname = g.groupname
+            WHERE CAST(g.groupid AS VARCHAR) = CAST(c.nhisgroupid AS VARCHAR)
+              AND CAST(c.encounterdatefrom AS TIMESTAMP)
+                  BETWEEN CAST(gc.startdate AS TIMESTAMP) AND CAST(gc.enddate AS TIMESTAMP)
+        )
+    """,
+    "GROUPS": """
+        SELECT CAST(groupid AS VARCHAR) AS groupid,
+               CAST(groupname AS VARCHAR) AS groupname
+        FROM clearline_db.all_group
+    """,
+    "DEBIT": """
+        SELECT company_name,
+               CAST("from" AS TIMESTAMP) AS "from",
+               CAST(amount AS DOUBLE) AS amount
+        FROM clearline_db.debit_note
+        WHERE description IS NULL OR description NOT ILIKE '%tpa%'
+    """,
+    # Family-scheme PA cost per enrollee and plan, counting only PA requested within the
+    # enrollee's active period
+    "RETAIL_MLR": """
+        WITH family_pa AS (
+            SELECT CAST(iid AS VARCHAR) AS iid,
+                   CAST(requestdate AS TIMESTAMP) AS requestdate,
+                   TRY_CAST(granted AS DOUBLE) AS granted
+            FROM clearline_db.total_pa_procedures
+            WHERE lower(groupname) = 'family scheme'
+        ),
+        -- Semi-join enrollees and their current plans down to family-scheme PA members
+        -- first, so the enrichment joins below build on the retail subset only
+        enrollees AS (
+            SELECT CAST(legacycode AS VARCHAR) AS legacycode,
+                   CAST(memberid AS BIGINT) AS memberid,
+                   TRY_CAST(effectivedate AS TIMESTAMP) AS effectivedate,
+                   TRY_CAST(terminationdate AS TIMESTAMP) AS terminationdate
+            FROM clearline_db.all_active_member
+            WHERE CAST(legacycode AS VARCHAR) IN (SELECT iid FROM family_pa)
+        ),
+        current_plans AS (
+            SELECT CAST(memberid AS BIGINT) AS memberid,
+                   CAST(planid AS BIGINT) AS planid
+            FROM clearline_db.member_plans
+            WHERE CAST(iscurrent AS VARCHAR) = 'true'
+              AND CAST(memberid AS BIGINT) IN (SELECT memberid FROM enrollees)
+        ),
+        retail_pa AS (
+            SELECT pa.iid,
+                   p.planname,
+                   pa.granted
+            FROM family_pa pa
+            LEFT JOIN enrollees e ON e.legacycode = pa.iid
+            LEFT JOIN current_plans cp ON cp.memberid = e.memberid
+            LEFT JOIN clearline_db.plans p ON CAST(p.planid AS BIGINT) = cp.planid
+            WHERE pa.requestdate BETWEEN e.effectivedate AND e.terminationdate
+        )
+        SELECT iid,
+               COALESCE(SUM(granted), 0) AS total_cost,
+               planname
+        FROM retail_pa
+        GROUP BY iid, planname
+    """,
+    # Total premium per family-scheme plan
+    "RETAIL_PREMIUM": """
+        SELECT p.planname,
+               COALESCE(SUM(
+                   CAST(gp.individualprice AS DOUBLE) * gp.countofindividual
+                   + gp.countoffamily * CAST(gp.familyprice AS DOUBLE)
+               ), 0) AS total_premium
+        FROM clearline_db.group_plan gp
+        JOIN clearline_db.all_group g ON CAST(g.groupid AS BIGINT) = CAST(gp.groupid AS BIGINT)
+        LEFT JOIN clearline_db.plans p ON CAST(p.planid AS BIGINT) = CAST(gp.planid AS BIGINT)
+        WHERE lower(g.groupname) = 'family scheme'
+        GROUP BY p.planname
+    """,
+}
+
+# The MLR and retail tables are loaded separately, so a failing retail query only
+# affects the retail section of the dashboard
+MLR_TABLES = ("PA", "GROUP_CONTRACT", "CLAIMS", "GROUPS", "DEBIT")
+RETAIL_TABLES = ("RETAIL_MLR", "RETAIL_PREMIUM")
+
+# Join/group-by keys are dictionary-encoded, so joins hash integer codes instead of strings
+CATEGORICAL_COLUMNS = {
+    "PA": ["groupname"],
+    "GROUP_CONTRACT": ["groupname"],
+    "GROUPS": ["groupname"],
+    "DEBIT": ["company_name"],
+    "RETAIL_MLR": ["planname"],
+    "RETAIL_PREMIUM": ["planname"],
+}
+
+# Before Polars 1.32 categorical codes only match across separately built frames under a
+# global string cache; newer releases always share one global mapping (and deprecate the call)
+if tuple(int(part) for part in pl.__version__.split(".")[:2]) < (1, 32):
+    pl.enable_string_cache()
+
+def connection_is_alive(con):
+    """Check that a cached MotherDuck connection still answers queries"""
+    try:
+        con.execute("SELECT 1").fetchone()
+        return True
+    except Exception:
+        return False
+
+@st.cache_resource(validate=connection_is_alive)
+def get_motherduck_connection():
+    """Open one MotherDuck connection and reuse it across reruns"""
+    motherduck_token = os.environ.get("MOTHERDUCK_TOKEN")
+    return duckdb.connect(f"md:my_CIL_DB?motherduck_token={motherduck_token}")
+
+def fetch_table(cursor, table_name):
+    """Run one table query on its own cursor and return it as a Polars frame"""
+    try:
+        # DuckDB hands the Arrow result straight to Polars without building a pandas
+        # DataFrame; .pl() also keeps the schema for empty results across DuckDB versions
+        df = cursor.execute(TABLE_QUERIES[table_name]).pl()
+        return df.with_columns([
+            pl.col(col).cast(pl.Categorical) for col in CATEGORICAL_COLUMNS.get(table_name, [])
+        ])
+    finally:
+        cursor.close()
+
+@st.cache_resource(ttl=3600)
+def load_tables(table_names):
+    """Load the given tables from MotherDuck as a dict of Polars frames keyed by table name"""
+    # cache_resource keeps the frames in-process by reference, so a rerun doesn't pay
+    # the pickle/unpickle round-trip that cache_data does for every hit
+    con = get_motherduck_connection()
+
+    # Each query gets its own cursor on the shared (warm) connection and all of them are
+    # submitted at once; DuckDB releases the GIL while a query runs, so the MotherDuck
+    # round-trips overlap instead of being paid one after another
+    cursors = {table_name: con.cursor() for table_name in table_names}
+    with ThreadPoolExecutor(max_workers=len(cursors)) as pool:
+        futures = {
+            table_name: pool.submit(fetch_table, cursor, table_name)
+            for table_name, cursor in cursors.items()
+        }
+        return {table_name: future.result() for table_name, future in futures.items()}
+
+def load_data_from_motherduck(table_names):
     """Load data from MotherDuck with caching"""
     try:
         # Get MotherDuck token from environment variables (Railway)
@@ -26,65 +203,45 @@ def load_data_from_motherduck():
             st.info("Please add MOTHERDUCK_TOKEN to your Railway project variables.")
             return None
         
-        # Connect using token in the connection string
-        con = duckdb.connect(f"md:my_CIL_DB?motherduck_token={motherduck_token}")
-
-        # Step 3: Query the tables and load into pandas DataFrames
         with st.spinner("Loading data from MotherDuck..."):
-            GROUP_CONTRACT = con.execute("SELECT * FROM clearline_db.group_contract").fetchdf()
-            CLAIMS = con.execute("SELECT * FROM clearline_db.claims").fetchdf()
-            GROUPS = con.execute("SELECT * FROM clearline_db.all_group").fetchdf()
-            DEBIT = con.execute("SELECT * FROM clearline_db.debit_note").fetchdf()
-            PA = con.execute("SELECT * FROM clearline_db.total_pa_procedures").fetchdf()
-            ACTIVE_ENROLLEE = con.execute("SELECT * FROM clearline_db.all_active_member").fetchdf()
-            M_PLAN = con.execute("SELECT * FROM clearline_db.member_plans").fetchdf()
-            G_PLAN = con.execute("SELECT * FROM clearline_db.group_plan").fetchdf()
-            PLAN = con.execute("SELECT * FROM clearline_db.plans").fetchdf()
-            
-            # Convert to Polars DataFrames
-            GROUP_CONTRACT = pl.from_pandas(GROUP_CONTRACT)
-            CLAIMS = pl.from_pandas(CLAIMS)
-            GROUPS = pl.from_pandas(GROUPS)
-            DEBIT = pl.from_pandas(DEBIT)
-            PA = pl.from_pandas(PA)
-            ACTIVE_ENROLLEE = pl.from_pandas(ACTIVE_ENROLLEE)
-            M_PLAN = pl.from_pandas(M_PLAN)
-            G_PLAN = pl.from_pandas(G_PLAN)
-            PLAN = pl.from_pandas(PLAN)
-            
-        con.close()
-        return PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT, ACTIVE_ENROLLEE, M_PLAN, G_PLAN, PLAN
+            return load_tables(table_names)
         
     except Exception as e:
+        # Drop the cached connection so the next load reconnects (e.g. after a dropped
+        # connection or an expired token) instead of failing until the container restarts
+        get_motherduck_connection.clear()
         st.error(f"Error loading data: {str(e)}")
-        return None, None, None, None, None, None, None, None, None
+        return None
 
+# Cached calculations fingerprint their Polars inputs by identity and shape instead of
+# hashing every cell; the inputs come from load_tables, so a reload yields new frames and
+# the entries expire on the same hourly TTL as the loader instead of piling up
+FRAME_HASH_FUNCS = {pl.DataFrame: lambda df: (id(df), df.height, df.width, tuple(df.columns))}
+
+@st.cache_data(ttl=3600, hash_funcs=FRAME_HASH_FUNCS)
 def calculate_mlr(PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT):
     """Calculate MLR metrics"""
     try:
+        # Build the whole computation as one lazy plan so Polars can push
+        # predicates/projections through the joins and collect once at the end
+        PA = PA.lazy()
+        CLAIMS = CLAIMS.lazy()
+        GROUPS = GROUPS.lazy()
+        DEBIT = DEBIT.lazy()
+
+        # Contract dates are small (a row per contract), so they are materialized once and the
+        # same in-memory frame is the build side of the PA, CLAIMS and DEBIT joins
+        group_contract_dates = GROUP_CONTRACT.select(['groupname', 'startdate', 'enddate']).lazy()
+
         # --- PA MLR ---
-        PA = PA.with_columns([
-            pl.col('requestdate').cast(pl.Datetime),
-            pl.col('granted').cast(pl.Float64, strict=False)
-        ])
-        group_contract_dates = GROUP_CONTRACT.select(['groupname', 'startdate', 'enddate']).with_columns([
-            pl.col('startdate').cast(pl.Datetime),
-            pl.col('enddate').cast(pl.Datetime)
-        ])
         pa_filtered = PA.join(group_contract_dates, on='groupname', how='inner').filter(
-            (pl.col('requestdate') >= pl.col('startdate')) & (pl.col('requestdate') <= pl.col('enddate'))
+            pl.col('requestdate').is_between(pl.col('startdate'), pl.col('enddate'), closed='both')
         )
         PA_mlr = pa_filtered.group_by('groupname').agg(
             pl.col('granted').sum().alias('Total cost')
         )
 
         # --- CLAIMS MLR ---
-        CLAIMS = CLAIMS.with_columns([
-            pl.col('approvedamount').cast(pl.Float64),
-            pl.col('encounterdatefrom').cast(pl.Datetime),
-            pl.col('nhisgroupid').cast(pl.Utf8)
-        ])
-        GROUPS = GROUPS.with_columns(pl.col('groupid').cast(pl.Utf8))
         claims_with_group = CLAIMS.join(
             GROUPS.select(['groupid', 'groupname']),
             left_on='nhisgroupid', right_on='groupid', how='inner'
@@ -92,89 +249,83 @@ def calculate_mlr(PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT):
         claims_with_dates = claims_with_group.join(
             group_contract_dates, on='groupname', how='inner'
         ).filter(
-            (pl.col('encounterdatefrom') >= pl.col('startdate')) & (pl.col('encounterdatefrom') <= pl.col('enddate'))
+            pl.col('encounterdatefrom').is_between(pl.col('startdate'), pl.col('enddate'), closed='both')
         )
         claims_mlr = claims_with_dates.group_by('groupname').agg(
             pl.col('approvedamount').sum().alias('Total cost')
-        ).sort('Total cost', descending=True)
+        )
 
         # --- DEBIT NOTE (filtered by contract dates) ---
-        # Ensure DEBIT is pandas DataFrame for filtering
-        if not isinstance(DEBIT, pd.DataFrame):
-            DEBIT = DEBIT.to_pandas()
-        
-        # Convert date column and filter out rows containing "tpa" in description
-        DEBIT['from'] = pd.to_datetime(DEBIT['from'])
-        CURRENT_DEBIT = DEBIT[~DEBIT['description'].str.contains('tpa', case=False, na=False)]
-        
-        # Change company_name to groupname for consistency
-        CURRENT_DEBIT = CURRENT_DEBIT.rename(columns={'company_name': 'groupname'})
-        
-        # Convert to polars for joining with contract dates
-        current_debit_pl = pl.from_pandas(CURRENT_DEBIT)
+        # Change company_name to groupname for consistency ("tpa" lines are already
+        # dropped by the DEBIT query)
+        current_debit = DEBIT.rename({'company_name': 'groupname'})
         
         # Join with contract dates and filter by contract period
-        debit_with_dates = current_debit_pl.join(
+        debit_with_dates = current_debit.join(
             group_contract_dates, on='groupname', how='inner'
         ).filter(
-            (pl.col('from') >= pl.col('startdate')) & (pl.col('from') <= pl.col('enddate'))
+            pl.col('from').is_between(pl.col('startdate'), pl.col('enddate'), closed='both')
         )
         
-        # Group by company and sum amounts within contract period
+        # Group by company and sum amounts within contract period; the 10% commission
+        # is attached here once and shared by both the PA and CLAIMS MLR frames
         DEBIT_BY_CLIENT = debit_with_dates.group_by('groupname').agg(
-            pl.col('amount').sum().alias('amount')
-        ).sort('amount', descending=True)
+            pl.col('amount').sum().alias('Total cost(DEBIT_BY_CLIENT)')
+        ).with_columns(
+            (pl.col('Total cost(DEBIT_BY_CLIENT)') * 0.10).round(2).alias('commission')
+        )
 
         # --- Merge Results ---
-        debit_df = DEBIT_BY_CLIENT.rename({'amount': 'Total cost(DEBIT_BY_CLIENT)'})
-        pa_df = PA_mlr.rename({'Total cost': 'Total cost(PA)'}).with_columns(
-            (pl.col('Total cost(PA)') * 1.4).round(2).alias('PA40%')
-        )
+        debit_df = DEBIT_BY_CLIENT
+        pa_df = PA_mlr.rename({'Total cost': 'Total cost(PA)'})
         claims_df = claims_mlr.rename({'Total cost': 'Total cost(claims)'})
 
+        # PA plus 40%; defined once so 'PA40%' and the MLR share the same expression
+        pa40 = (pl.col('Total cost(PA)') * 1.4).round(2)
+
         # Calculate PA MLR DataFrame
+        # DEBIT is the MLR denominator, so it anchors a left join; groups without
+        # PA simply get a null PA cost. The derived columns are computed in the same
+        # select as the final projection, in a single pass over the joined frame, and
+        # only this final frame is sorted (highest MLR first; NaN from a zero debit total
+        # is sorted with the nulls at the bottom, since Polars ranks NaN above every number).
         pa_merged = debit_df.join(
-            pa_df.select(['groupname', 'Total cost(PA)', 'PA40%']),
-            on='groupname', how='outer'
-        )
-        pa_merged = pa_merged.with_columns(
-            (pl.col('Total cost(DEBIT_BY_CLIENT)') * 0.10).round(2).alias('commission')
+            pa_df.select(['groupname', 'Total cost(PA)']),
+            on='groupname', how='left'
         ).select([
             'groupname',
             'Total cost(DEBIT_BY_CLIENT)',
             'Total cost(PA)',
-            'PA40%',
-            'commission'
-        ])
-        pa_merged = pa_merged.with_columns([
+            pa40.alias('PA40%'),
+            'commission',
             (
-                (pl.col('PA40%').fill_null(0) +
+                (pa40.fill_null(0) +
                     pl.col('commission').fill_null(0)
-                ) / pl.col('Total cost(DEBIT_BY_CLIENT)').fill_null(0) * 100
+                ) / pl.col('Total cost(DEBIT_BY_CLIENT)') * 100
             ).round(2).alias('MLR(PA) (%)')
-        ])
+        ]).sort(pl.col('MLR(PA) (%)').fill_nan(None), descending=True, nulls_last=True)
 
-        # Calculate CLAIMS MLR DataFrame
+        # Calculate CLAIMS MLR DataFrame (anchored on DEBIT as above)
         claims_merged = debit_df.join(
             claims_df.select(['groupname', 'Total cost(claims)']),
-            on='groupname', how='outer'
-        )
-        claims_merged = claims_merged.with_columns(
-            (pl.col('Total cost(DEBIT_BY_CLIENT)') * 0.10).round(2).alias('commission')
+            on='groupname', how='left'
         ).select([
             'groupname',
             'Total cost(DEBIT_BY_CLIENT)',
             'Total cost(claims)',
-            'commission'
-        ])
-        claims_merged = claims_merged.with_columns([
+            'commission',
             (
                 (
                     pl.col('Total cost(claims)').fill_null(0) +
                     pl.col('commission').fill_null(0)
-                ) / pl.col('Total cost(DEBIT_BY_CLIENT)').fill_null(0) * 100
+                ) / pl.col('Total cost(DEBIT_BY_CLIENT)') * 100
             ).round(2).alias('MLR(CLAIMS) (%)')
-        ])
+        ]).sort(pl.col('MLR(CLAIMS) (%)').fill_nan(None), descending=True, nulls_last=True)
+
+        # Collect both plans together so the shared DEBIT/contract subplans run once. The
+        # streaming engine processes the large PA/CLAIMS x contract-window joins in morsels
+        # instead of materializing the joined frames before filtering
+        pa_merged, claims_merged = pl.collect_all([pa_merged, claims_merged], engine='streaming')
 
         # Return both DataFrames
         return pa_merged, claims_merged
@@ -183,169 +334,24 @@ def calculate_mlr(PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT):
         st.error(f"Error calculating MLR: {str(e)}")
         return pl.DataFrame(), pl.DataFrame()
 
-def calculate_retail_mlr(PA, ACTIVE_ENROLLEE, M_PLAN, G_PLAN, GROUPS, PLAN):
+@st.cache_data(ttl=3600, hash_funcs=FRAME_HASH_FUNCS)
+def calculate_retail_mlr(RETAIL_MLR, RETAIL_PREMIUM):
     try:
-        # Ensure consistent data types
-        ACTIVE_ENROLLEE = ACTIVE_ENROLLEE.with_columns([
-            pl.col("legacycode").cast(pl.Utf8),
-            pl.col("memberid").cast(pl.Int64)
-        ])
-
-        M_PLAN = M_PLAN.with_columns([
-            pl.col("memberid").cast(pl.Int64),
-            pl.col("planid").cast(pl.Int64),
-            pl.col("iscurrent").cast(pl.Utf8)
-        ])
-
-        G_PLAN = G_PLAN.with_columns([
-            pl.col("planid").cast(pl.Int64),
-            pl.col("groupid").cast(pl.Int64),
-            pl.col("individualprice").cast(pl.Float64),
-            pl.col("familyprice").cast(pl.Float64),
-            pl.col("maxnumdependant").cast(pl.Int64)
-        ])
-
-        PA = PA.with_columns([
-            pl.col("requestdate").cast(pl.Datetime),
-            pl.col("iid").cast(pl.Utf8),
-            pl.col("granted").cast(pl.Float64)
-        ])
-
-        GROUPS = GROUPS.with_columns([
-            pl.col("groupid").cast(pl.Int64),
-            pl.col("groupname").cast(pl.Utf8)
-        ])
-
-        # Filter current plans
-        M_PLANN = M_PLAN.filter(pl.col("iscurrent") == "true")
-        PAA = PA.with_columns(pl.col("requestdate").dt.year().alias("year"))
-
-        # Join with group names
-        G_PLANN = G_PLAN.join(
-            GROUPS.select(['groupid', 'groupname']),
-            on='groupid',
-            how='left'
-        )
-        # Filter G_PLANN to only include rows where groupname is 'FAMILY SCHEME' (case-insensitive)
-        G_PLANN = G_PLANN.filter(
-            pl.col("groupname").str.to_lowercase() == "family scheme"
-        )
-
-        # Isolate all unique planid in G_PLANN
-        unique_planids = G_PLANN.select("planid").unique()
-
-        # Filter ACTIVE_ENROLLEE to only contain data where their planid is inside the isolated planids of G_PLANN
-        # First, ensure ACTIVE_ENROLLEE has planid column (join if necessary)
-        if 'planid' in ACTIVE_ENROLLEE.columns:
-            ACTIVE_ENROLLEE = ACTIVE_ENROLLEE.drop('planid')
-        ACTIVE_ENROLLEE = ACTIVE_ENROLLEE.join(
-            M_PLANN.select(['memberid', 'planid']),
-            on='memberid',
-            how='left'
-        )
-        # Now filter ACTIVE_ENROLLEE to only those with planid in unique_planids
-        ACTIVE_RETAIL = ACTIVE_ENROLLEE.join(
-            unique_planids,
-            on="planid",
-            how="inner"
-        )
-
-        # Merge G_PLANN and PLAN to get 'planname' into G_PLANN using 'planid' as common column
-        if 'planid' in G_PLANN.columns and 'planid' in PLAN.columns:
-            F_GPLAN = G_PLANN.join(
-                PLAN.select(['planid', 'planname']),
-                on='planid',
-                how='left'
-            )
-        else:
-            F_GPLAN = G_PLANN
-
-        # Create a new column 'premium' for each row: (individualprice * countofindividual + countoffamily * familyprice)
-        FG_PLANN = F_GPLAN.with_columns(
-            (pl.col("individualprice") * pl.col("countofindividual") + pl.col("countoffamily") * pl.col("familyprice")).alias("premium")
-        )
-        # Calculate total retail premium as the sum of the 'premium' column
-        # Group by 'planname' and sum 'premium' for each planname
-        total_retail_premium_by_plan = FG_PLANN.group_by("planname").agg(
-            pl.col("premium").sum().alias("total_premium")
-        )
-
-        # Join with ACTIVE_ENROLLEE
-        PA_M = PA.join(
-            ACTIVE_ENROLLEE.select(['legacycode', 'memberid']),
-            left_on='iid',
-            right_on='legacycode',
-            how='left'
-        )
-
-        # Join with M_PLANN
-        PA_MP = PA_M.join(
-            M_PLANN.select(['memberid', 'planid']),
-            on='memberid',
-            how='left'
-        )
-
-        # Filter PA to only include rows where groupname is 'family scheme' (case-insensitive)
-        PAA = PA_MP.filter(
-            pl.col("groupname").str.to_lowercase() == "family scheme"
-        )
-
-        # Join PLAN to PAA to get 'planname' into PAA using 'planid'
-        if 'planid' in PAA.columns and 'planid' in PLAN.columns:
-            PAA = PAA.join(
-                PLAN.select(['planid', 'planname']),
-                on='planid',
-                how='left'
-            )
-
-        # Join PAA with ACTIVE_ENROLLEE to get effectivedate and terminationdate for each iid
-        if 'iid' in PAA.columns and 'legacycode' in ACTIVE_ENROLLEE.columns:
-            PAA = PAA.join(
-                ACTIVE_ENROLLEE.select(['legacycode', 'effectivedate', 'terminationdate']),
-                left_on='iid',
-                right_on='legacycode',
-                how='left'
-            )
-
-        # Filter PAA to only include claims within the customer's active period
-        # This is the key step that was missing in your original code
-        if all(col in PAA.columns for col in ['iid', 'planname', 'granted', 'requestdate', 'effectivedate', 'terminationdate']):
-            # Filter claims to only those within the customer's active enrollment period
-            filtered_PAA = PAA.filter(
-                (pl.col('requestdate') >= pl.col('effectivedate')) & 
-                (pl.col('requestdate') <= pl.col('terminationdate'))
-            )
-            
-            # Now group by IID and planname, and sum the granted amounts
-            grouped_PAA = filtered_PAA.group_by(['iid', 'planname']).agg(
-                pl.col('granted').sum().alias('total_cost')
-            )
-            
-            # Select final columns: IID (or legacycode), total_cost, planname
-            result_df = grouped_PAA.select(['iid', 'total_cost', 'planname'])
-        else:
-            grouped_PAA = pl.DataFrame()
+        # The enrollee/plan joins and the per-member aggregation already ran in DuckDB
+        # (see RETAIL_MLR / RETAIL_PREMIUM); only the small per-plan roll-up is left here
+        result_df = RETAIL_MLR.select(['iid', 'total_cost', 'planname'])
 
         # Group result_df by planname and sum total_cost
         total_cost_by_plan = result_df.group_by('planname').agg(
             pl.col('total_cost').sum().alias('total_cost')
         )
 
-        # Ensure 'planname' is string type in both DataFrames before merging
-        if 'planname' in total_retail_premium_by_plan.columns and 'planname' in total_cost_by_plan.columns:
-            total_retail_premium_by_plan = total_retail_premium_by_plan.with_columns(
-                pl.col('planname').cast(pl.Utf8)
-            )
-            total_cost_by_plan = total_cost_by_plan.with_columns(
-                pl.col('planname').cast(pl.Utf8)
-            )
-            merged_plan_df = total_retail_premium_by_plan.join(
-                total_cost_by_plan,
-                on='planname',
-                how='left'
-            )
-        else:
-            merged_plan_df = pl.DataFrame()
+        # Both sides carry the categorical 'planname', so they join directly
+        merged_plan_df = RETAIL_PREMIUM.join(
+            total_cost_by_plan,
+            on='planname',
+            how='left'
+        )
 
         return result_df, merged_plan_df
 
@@ -356,51 +362,54 @@ def calculate_retail_mlr(PA, ACTIVE_ENROLLEE, M_PLAN, G_PLAN, GROUPS, PLAN):
 # Main Streamlit app
 if __name__ == "__main__":
     # Load data
-    PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT, ACTIVE_ENROLLEE, M_PLAN, G_PLAN, PLAN = load_data_from_motherduck()
+    data = load_data_from_motherduck(MLR_TABLES)
     
-    if all(df is not None for df in [PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT, ACTIVE_ENROLLEE, M_PLAN, G_PLAN, PLAN]):
+    if data is not None:
         # Calculate MLR
-        pa_merged, claims_merged = calculate_mlr(PA, GROUP_CONTRACT, CLAIMS, GROUPS, DEBIT)
+        pa_merged, claims_merged = calculate_mlr(
+            data["PA"], data["GROUP_CONTRACT"], data["CLAIMS"], data["GROUPS"], data["DEBIT"]
+        )
         
         if pa_merged.height > 0 or claims_merged.height > 0:
             st.subheader("MLR Analysis Results (PA)")
             if pa_merged.height > 0:
-                # Convert to pandas for styling
-                pa_df = pa_merged.to_pandas()
-                
-                # Create a function to highlight rows with MLR > 75%
-                def highlight_high_mlr(row):
-                    if row['MLR(PA) (%)'] > 75:
-                        return ['background-color: #ffcccc; color: red; font-weight: bold'] * len(row)
-                    return [''] * len(row)
+                # Flag rows with MLR > 75% in Polars (NaN/null MLR is not flagged, as in pandas)
+                high_mlr_mask = (pa_merged.get_column('MLR(PA) (%)').fill_nan(None) > 75).fill_null(False)
                 
-                # Apply styling
-                styled_pa_df = pa_df.style.apply(highlight_high_mlr, axis=1)
-                st.dataframe(styled_pa_df, use_container_width=True)
+                if high_mlr_mask.any():
+                    # Highlighting needs pandas' Styler; the comparison has already run once over
+                    # the column and the per-row styles are broadcast to every column
+                    row_styles = np.where(high_mlr_mask.to_numpy(), HIGH_MLR_STYLE, '')
+                    styled_pa_df = pa_merged.to_pandas().style.apply(lambda _: row_styles, axis=0)
+                    st.dataframe(styled_pa_df, use_container_width=True, hide_index=True)
+                else:
+                    # Nothing to highlight, so Streamlit renders the Polars frame directly
+                    # (the index is hidden on both paths so the table layout stays the same)
+                    st.dataframe(pa_merged, use_container_width=True, hide_index=True)
                 
                 # Get companies with MLR > 75%
-                high_mlr_pa_companies = pa_df[pa_df['MLR(PA) (%)'] > 75]['groupname'].tolist()
+                high_mlr_pa_companies = pa_merged.filter(high_mlr_mask).get_column('groupname').to_list()
             else:
                 st.warning("No PA MLR data available to display.")
                 high_mlr_pa_companies = []
 
             st.subheader("MLR Analysis Results (Claims)")
             if claims_merged.height > 0:
-                # Convert to pandas for styling
-                claims_df = claims_merged.to_pandas()
+                # Flag rows with MLR > 75% in Polars (NaN/null MLR is not flagged, as in pandas)
+                high_mlr_mask = (claims_merged.get_column('MLR(CLAIMS) (%)').fill_nan(None) > 75).fill_null(False)
                 
-                # Create a function to highlight rows with MLR > 75%
-                def highlight_high_mlr_claims(row):
-                    if row['MLR(CLAIMS) (%)'] > 75:
-                        return ['background-color: #ffcccc; color: red; font-weight: bold'] * len(row)
-                    return [''] * len(row)
-                
-                # Apply styling
-                styled_claims_df = claims_df.style.apply(highlight_high_mlr_claims, axis=1)
-                st.dataframe(styled_claims_df, use_container_width=True)
+                if high_mlr_mask.any():
+                    # Highlighting needs pandas' Styler; the comparison has already run once over
+                    # the column and the per-row styles are broadcast to every column
+                    row_styles = np.where(high_mlr_mask.to_numpy(), HIGH_MLR_STYLE, '')
+                    styled_claims_df = claims_merged.to_pandas().style.apply(lambda _: row_styles, axis=0)
+                    st.dataframe(styled_claims_df, use_container_width=True, hide_index=True)
+                else:
+                    # Nothing to highlight, so Streamlit renders the Polars frame directly
+                    st.dataframe(claims_merged, use_container_width=True, hide_index=True)
                 
                 # Get companies with MLR > 75%
-                high_mlr_claims_companies = claims_df[claims_df['MLR(CLAIMS) (%)'] > 75]['groupname'].tolist()
+                high_mlr_claims_companies = claims_merged.filter(high_mlr_mask).get_column('groupname').to_list()
             else:
                 st.warning("No Claims MLR data available to display.")
                 high_mlr_claims_companies = []
@@ -433,22 +442,27 @@ if __name__ == "__main__":
         # --- Retail MLR Section ---
         st.subheader("Retail MLR Analysis Results")
         try:
+            # Retail tables have their own cached load, so a retail query error is reported
+            # here without affecting the MLR tables above
+            with st.spinner("Loading retail data from MotherDuck..."):
+                retail_data = load_tables(RETAIL_TABLES)
+
             # Call the retail MLR calculation function
             result_df, merged_plan_df = calculate_retail_mlr(
-                PA, ACTIVE_ENROLLEE, M_PLAN, G_PLAN, GROUPS, PLAN
+                retail_data["RETAIL_MLR"], retail_data["RETAIL_PREMIUM"]
             )
 
             # Display result_df
             st.markdown("**Retail MLR - Individual/Plan Breakdown**")
             if result_df is not None and result_df.height > 0:
-                st.dataframe(result_df.to_pandas(), use_container_width=True)
+                st.dataframe(result_df, use_container_width=True)
             else:
                 st.info("No retail MLR (result_df) data available.")
 
             # Display total_retail_premium_by_plan
             st.markdown("**Total Retail Premium by Plan**")
             if merged_plan_df is not None and merged_plan_df.height > 0:
-                st.dataframe(merged_plan_df.to_pandas(), use_container_width=True)
+                st.dataframe(merged_plan_df, use_container_width=True)
             else:
                 st.info("No retail premium by plan data available.")
         except Exception as e: